@@ -1,25 +1,162 @@
+import hashlib
+from functools import lru_cache
+import time
 import urllib3
-from docx import Document
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+from django.core.cache import cache
+from docx.oxml.ns import qn
+from docx.oxml.parser import parse_xml
+import io
+import xlsxwriter
 import requests
-from bs4 import BeautifulSoup
+import lxml.etree
 import re
+import zipfile
+
+# Shared session so the connection to lex.uz is kept alive between uploads
+_session = requests.Session()
+_session.headers.update({
+    "User-Agent": (
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+        "AppleWebKit/537.36 (KHTML, like Gecko) "
+        "Chrome/120.0.0.0 Safari/537.36"
+    ),
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.9",
+    "Connection": "keep-alive",
+    "Referer": "https://lex.uz/",
+})
+# Disable warnings for verify=False
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+# Header texts that identify the import duty rates table on lex.uz
+_RATES_HEADER_MARKERS = ("ТИФ ТНнинг 2022 йилги таҳрири", "Импорт божхона божи ставкаси")
+
+# Excel header styles
+_HEADER_FORMAT = {
+    'bold': True,
+    'font_color': '#FFFFFF',
+    'font_size': 11,
+    'bg_color': '#4472C4',
+    'pattern': 1,
+    'align': 'center',
+    'valign': 'vcenter',
+    'text_wrap': True,
+    'border': 1,  # thin
+}
+
+# How long fetched duty rates are reused before lex.uz is asked again
+DUTY_RATES_CACHE_TIMEOUT = 60 * 60
+
+# Precompiled patterns for translate_rate (called once per duty-rate row)
+_RE_CYRILLIC = re.compile(r'[\u0400-\u04FF]')
+_RE_STARRED = re.compile(r'[\d,\s*]+[\*]+')
+# Prioritize 'АҚШ доллари' (full form) over 'АҚШ долл.' (abbreviated):
+# alternatives are tried left to right
+_BASIC_REPLACEMENTS = {
+    "АҚШ доллари": "долл. США",
+    "АҚШ долл.": "долл. США",
+    "/кг": " за кг",
+}
+_RE_BASIC_REPLACE = re.compile('|'.join(re.escape(k) for k in _BASIC_REPLACEMENTS))
+_RE_MIN_AMOUNT = re.compile(
+    r'(.+),\s*лекин\s*(ҳар бир|ҳар)\s*(.*?)\s*дан кам бўлмаган миқдорда',
+    re.IGNORECASE | re.DOTALL
+)
+_RE_GENERIC_MIN = re.compile(r'(.*),\s*лекин\s*(.*)\s*дан кам эмас', re.IGNORECASE | re.DOTALL)
+_RE_ADDITIVE = re.compile(
+    r'([\d\s.,]+)\s*\+\s*([\d\s.,]+)\s*(долл\. США)\s*ҳар бир\s*(.+)\s*учун([\*]*)',
+    re.IGNORECASE | re.DOTALL
+)
+
+# Map Uzbek units/phrases to Russian.
+# All unit phrases are fused into one alternation; the named group that
+# captured the amount identifies the unit (see _UNIT_TEMPLATES).
+_UNIT_ALT = re.compile(
+    r'ҳар бир килограмми учун (?P<kg>[\d\s.,]+)\s*долл\. США'
+    r'|ҳар бир донаси учун (?P<piece>[\d\s.,]+)\s*долл\. США'
+    r'|ҳар бир литри учун (?P<liter>[\d\s.,]+)\s*долл\. США'
+    r'|ҳар бир жуфти учун (?P<pair>[\d\s.,]+)\s*долл\. США'
+    r'|ҳар бир м2 учун (?P<m2>[\d\s.,]+)\s*долл\. США'
+    r'|ҳар 1000 донаси учун (?P<piece1000>[\d\s.,]+)\s*долл\. США'
+)
+_UNIT_TEMPLATES = {
+    'kg': 'но не менее {} долл. США за килограмм',
+    'piece': 'но не менее {} долл. США за штуку',
+    'liter': 'но не менее {} долл. США за литр',
+    'pair': 'но не менее {} долл. США за пару',
+    'm2': 'но не менее {} долл. США за м2',
+    'piece1000': 'но не менее {} долл. США за 1000 штук',
+}
+
+# Translation tables for cleaning up TN VED cell text
+_CODE_TRANS = str.maketrans('', '', '\xa0 ')  # drop all spaces
+_NBSP_TRANS = str.maketrans({'\xa0': ' '})
+
+
+def _read_document_tables(docx_file):
+    """
+    Read the tables of a .docx from its main document part only, skipping
+    the styles, headers, numbering and media that Document() would load.
+    Returns: list of top-level w:tbl elements, same as doc.tables
+    """
+    with zipfile.ZipFile(docx_file) as package:
+        # The main part is normally word/document.xml, but the package
+        # relationships are what actually name it
+        part_name = 'word/document.xml'
+        rels = lxml.etree.fromstring(package.read('_rels/.rels'))
+        for rel in rels:
+            if rel.get('Type', '').endswith('/officeDocument'):
+                part_name = rel.get('Target').lstrip('/')
+                break
 
+        # python-docx's parser gives the elements its oxml helpers (grid_span, vMerge, ...)
+        document = parse_xml(package.read(part_name))
 
-def extract_abbreviations(doc):
+    return document.findall(qn('w:body') + '/' + qn('w:tbl'))
+
+def _table_rows(tbl):
+    """
+    Read cell texts of a w:tbl element straight from its XML in a single pass
+    instead of building python-docx cell objects for every row.
+    Spanned and vertically merged cells repeat their text like row.cells does.
+    Returns: list of rows, each a list of stripped cell texts
+    """
+    rows = []
+    above = {}  # grid offset -> text of the previous row
+
+    for tr in tbl.findall(qn('w:tr')):
+        cells = []
+        current = {}
+        offset = tr.grid_before
+
+        for tc in tr.findall(qn('w:tc')):
+            if tc.vMerge == 'continue':
+                text = above.get(offset, '')
+            else:
+                text = '\n'.join(p.text for p in tc.findall(qn('w:p'))).strip()
+
+            for _ in range(tc.grid_span):
+                current[offset] = text
+                cells.append(text)
+                offset += 1
+
+        rows.append(cells)
+        above = current
+
+    return rows
+
+def extract_abbreviations(tables):
     """
     Extract СОКРАЩЕНИЯ И СИМВОЛЫ from Table 1
     Returns: dict {abbreviation: full_name}
     """
     abbreviations = {}
-    if len(doc.tables) < 2:
+    if len(tables) < 2:
         return abbreviations
         
-    table = doc.tables[1]
+    table = tables[1]
 
-    for row in table.rows:
-        cells = [cell.text.strip() for cell in row.cells]
+    for cells in _table_rows(table):
         if len(cells) >= 2 and cells[0] and cells[1]:
             abbr = cells[0].replace('\n', ' / ')
             full_name = cells[1].replace('\n', ' / ')
@@ -27,19 +164,18 @@ def extract_abbreviations(doc):
 
     return abbreviations
 
-def extract_units(doc):
+def extract_units(tables):
     """
     Extract ЕДИНИЦЫ ИЗМЕРЕНИЯ from Table 2
     Returns: list of dicts with keys: name, symbol, code
     """
     units = []
-    if len(doc.tables) < 3:
+    if len(tables) < 3:
         return units
         
-    table = doc.tables[2]
+    table = tables[2]
 
-    for row in table.rows[1:]:  # Skip header
-        cells = [cell.text.strip() for cell in row.cells]
+    for cells in _table_rows(table)[1:]:  # Skip header
         if len(cells) >= 3:
             name, symbol, code = cells[0], cells[1], cells[2]
 
@@ -55,7 +191,7 @@ def extract_units(doc):
 
     return units
 
-def extract_tn_ved_codes(doc):
+def extract_tn_ved_codes(tables):
     """
     Extract all TN VED codes from tables with header containing 'Код ТН ВЭД'
     Returns: list of dicts with keys: code, name, unit
@@ -63,18 +199,17 @@ def extract_tn_ved_codes(doc):
     tn_ved_codes = []
 
     # Find all TN VED tables
-    for table in doc.tables:
-        if not table.rows:
+    for table in tables:
+        rows = _table_rows(table)
+        if not rows:
             continue
 
-        header_text = ' '.join([cell.text.strip() for cell in table.rows[0].cells])
+        header_text = ' '.join(rows[0])
         if 'Код' not in header_text or 'ТН ВЭД' not in header_text:
             continue
 
         # Extract data from this table
-        for row in table.rows[1:]:
-            cells = [cell.text.strip() for cell in row.cells]
-
+        for cells in rows[1:]:
             if len(cells) >= 4:
                 code = cells[1]
                 name = cells[2]
@@ -87,9 +222,9 @@ def extract_tn_ved_codes(doc):
                 continue
 
             # Clean up
-            code = code.replace('\xa0', '').replace(' ', '')
-            name = name.replace('\xa0', ' ').strip()
-            unit = unit.replace('\xa0', ' ').strip()
+            code = code.translate(_CODE_TRANS)
+            name = name.translate(_NBSP_TRANS).strip()
+            unit = unit.translate(_NBSP_TRANS).strip()
 
             if not name:
                 continue
@@ -107,14 +242,15 @@ def extract_all(docx_file):
     Extract all data from the document
     Returns: tuple (abbreviations, units, tn_ved_codes)
     """
-    doc = Document(docx_file)
+    tables = _read_document_tables(docx_file)
 
-    abbreviations = extract_abbreviations(doc)
-    units = extract_units(doc)
-    tn_ved_codes = extract_tn_ved_codes(doc)
+    abbreviations = extract_abbreviations(tables)
+    units = extract_units(tables)
+    tn_ved_codes = extract_tn_ved_codes(tables)
 
     return abbreviations, units, tn_ved_codes
 
+@lru_cache(maxsize=2048)  # rate expressions repeat across thousands of rows
 def translate_rate(text):
     """
     Translate duty rate expressions from Uzbek to Russian, covering various complex formats.
@@ -128,28 +264,27 @@ def translate_rate(text):
     if not text:
         return ""
 
+    # 0. Plain rates (e.g., "10", "15*") have no words to translate;
+    # every phrase handled below contains Cyrillic text or a '+'
+    if '+' not in text and not _RE_CYRILLIC.search(text):
+        return text.strip()
+
     # 1. Handle simple single-value/marked cases (e.g., "10*", "20***")
     # This should be done before complex regex to avoid false matches.
-    if re.fullmatch(r'[\d,\s*]+[\*]+', text.strip()):
+    if _RE_STARRED.fullmatch(text.strip()):
         return text.strip()
 
-    # 2. Basic currency and unit replacements
-    # Prioritize 'АҚШ доллари' (full form) over 'АҚШ долл.' (abbreviated)
-    text = text.replace("АҚШ доллари", "долл. США")
-    text = text.replace("АҚШ долл.", "долл. США")
-    text = text.replace("куб. см.", "куб. см.")  # Keeps it the same, just for completeness of units
-    text = text.replace("/кг", " за кг")
+    # 2. Basic currency and unit replacements, done in a single pass
+    text = _RE_BASIC_REPLACE.sub(lambda m: _BASIC_REPLACEMENTS[m.group(0)], text)
 
     # 3. Complex phrase: "X, лекин ... кам бўлмаган миқдорда"
     # Matches: '..., лекин <description> <amount> АҚШ долларидан кам бўлмаган миқдорда'
     # Captures:
     #   Group 1: The first part (e.g., "20")
     #   Group 2: The descriptive part (e.g., "ҳар бир килограмми учун 0,3")
-    match_min_amount = re.search(
-        r'(.+),\s*лекин\s*(ҳар бир|ҳар)\s*(.*?)\s*дан кам бўлмаган миқдорда',
-        text,
-        re.IGNORECASE | re.DOTALL
-    )
+    # Each regex is only tried when its literal keyword is present, since a
+    # substring check is much cheaper than a failing backtracking search
+    match_min_amount = _RE_MIN_AMOUNT.search(text) if 'лекин' in text.lower() else None
     if match_min_amount:
         part1 = match_min_amount.group(1).strip()  # e.g., "20"
 
@@ -161,37 +296,18 @@ def translate_rate(text):
         # Examples: "ҳар бир килограмми учун 0,3 долл. США" -> "не менее 0,3 долл. США за килограмм"
         # The key is to rearrange/translate the unit ('учун' means 'for')
 
-        # Map Uzbek units/phrases to Russian
-        unit_map = {
-            r'ҳар бир килограмми учун ([\d\s.,]+)\s*(долл\. США)': r'но не менее \1 долл. США за килограмм',
-            r'ҳар бир донаси учун ([\d\s.,]+)\s*(долл\. США)': r'но не менее \1 долл. США за штуку',
-            r'ҳар бир литри учун ([\d\s.,]+)\s*(долл\. США)': r'но не менее \1 долл. США за литр',
-            r'ҳар бир жуфти учун ([\d\s.,]+)\s*(долл\. США)': r'но не менее \1 долл. США за пару',
-            r'ҳар бир м2 учун ([\d\s.,]+)\s*(долл\. США)': r'но не менее \1 долл. США за м2',
-            r'ҳар 1000 донаси учун ([\d\s.,]+)\s*(долл\. США)': r'но не менее \1 долл. США за 1000 штук',
-        }
-
         translated_description = description_part
-        found_unit_match = False
-        for uzb_pattern, rus_replacement in unit_map.items():
-            # Use the unit_map to reformat and translate the descriptive part
-            match = re.search(uzb_pattern, description_part)
-            if match:
-                # Replace the entire descriptive phrase with the Russian equivalent
-                # Need to extract the amount and currency to insert into the Russian phrase
-                amount = match.group(1).strip()
-                # Create a specific pattern that captures everything before 'дан кам бўлмаган миқдорда'
-                # and everything after 'лекин' but before the amount and currency.
-
-                # Simple replacement for the most common structure:
-                translated_description = rus_replacement.replace(r'\1', amount)
-                found_unit_match = True
-                break
+        match = _UNIT_ALT.search(description_part)
+        if match:
+            # Replace the entire descriptive phrase with the Russian equivalent,
+            # inserting the captured amount into the template for that unit
+            amount = match.group(match.lastgroup).strip()
+            translated_description = _UNIT_TEMPLATES[match.lastgroup].format(amount)
 
         # If no specific unit match was found, fall back to a generic translation
-        if not found_unit_match:
+        if not match:
             # Handle the example: "15, лекин 0,15 АҚШ долл./кг дан кам эмас" (original structure)
-            match_generic_min = re.search(r'(.*),\s*лекин\s*(.*)\s*дан кам эмас', text, re.IGNORECASE | re.DOTALL)
+            match_generic_min = _RE_GENERIC_MIN.search(text)
             if match_generic_min:
                 part1 = match_generic_min.group(1).strip()
                 part2 = match_generic_min.group(2).strip()
@@ -210,11 +326,7 @@ def translate_rate(text):
     #   Group 1: The first rate (e.g., "70")
     #   Group 2: The additional rate (e.g., "3")
     #   Group 3: The unit marker (e.g., "куб. см. учун")
-    match_additive = re.search(
-        r'([\d\s.,]+)\s*\+\s*([\d\s.,]+)\s*(долл\. США)\s*ҳар бир\s*(.+)\s*учун([\*]*)',
-        text,
-        re.IGNORECASE | re.DOTALL
-    )
+    match_additive = _RE_ADDITIVE.search(text) if '+' in text else None
     if match_additive:
         part1 = match_additive.group(1).strip()
         part2 = match_additive.group(2).strip()
@@ -232,44 +344,65 @@ def translate_rate(text):
     # If the text has no complex structure, return it after basic currency replacement
     return text.strip()
 
+def _element_text(element):
+    """
+    Text of an HTML element with each text fragment stripped and joined,
+    same as BeautifulSoup's get_text(strip=True).
+    """
+    return ''.join(t.strip() for t in element.itertext())
+
 def fetch_duty_rates(url):
+    """
+    Fetch and parse duty rates, reusing the cached result for
+    DUTY_RATES_CACHE_TIMEOUT seconds. Once stale, the page is revalidated
+    with its ETag/Last-Modified and only re-parsed if it has changed.
+    Returns: dict {code: rate}
+    """
+    cache_key = 'duty_rates:' + hashlib.md5(url.encode()).hexdigest()
+    cached = cache.get(cache_key)
+
+    if cached and time.time() - cached['fetched_at'] < DUTY_RATES_CACHE_TIMEOUT:
+        print("Using cached duty rates")
+        return cached['rates_map']
+
     print(f"Fetching duty rates from {url}...")
-    # Disable warnings for verify=False
-    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
-    headers = {
-        "User-Agent": (
-            "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
-            "AppleWebKit/537.36 (KHTML, like Gecko) "
-            "Chrome/120.0.0.0 Safari/537.36"
-        ),
-        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-        "Accept-Language": "en-US,en;q=0.9",
-        "Connection": "keep-alive",
-        "Referer": "https://lex.uz/",
-    }
-
-    session = requests.Session()
+    headers = {}
+
+    if cached:
+        if cached['etag']:
+            headers["If-None-Match"] = cached['etag']
+        if cached['last_modified']:
+            headers["If-Modified-Since"] = cached['last_modified']
 
     retries = 5
-    html_content = None
+    rates_map = None
+    etag = last_modified = None
 
     for attempt in range(1, retries + 1):
         try:
             print(f"Attempt {attempt}/{retries} ...")
 
-            response = session.get(
+            with _session.get(
                 url,
                 headers=headers,
                 timeout=(5, 10),  # 5s to connect, 10s to read
                 allow_redirects=True,
-                verify=False
-            )
-
-            if response.status_code == 200:
-                html_content = response.text
-                print("Successfully fetched!")
-                break
+                verify=False,
+                stream=True
+            ) as response:
+
+                if response.status_code == 304 and cached:
+                    print("Duty rates not modified, using cached data")
+                    cached['fetched_at'] = time.time()
+                    cache.set(cache_key, cached, timeout=None)
+                    return cached['rates_map']
+
+                if response.status_code == 200:
+                    rates_map = stream_duty_rates(response)
+                    etag = response.headers.get("ETag")
+                    last_modified = response.headers.get("Last-Modified")
+                    print("Successfully fetched!")
+                    break
 
             print(f"Status: {response.status_code}, retrying...")
 
@@ -280,54 +413,116 @@ def fetch_duty_rates(url):
         except Exception as e:
             print(f"Unknown error: {e}, retrying...")
 
-    if not html_content:
+        # Back off exponentially between attempts: 0.2s, 0.4s, 0.8s, ...
+        if attempt < retries:
+            time.sleep(0.2 * 2 ** (attempt - 1))
+
+    if rates_map is None:
         print("Failed to fetch data from lex.uz")
         return {}
 
+    if rates_map:
+        cache.set(cache_key, {
+            'etag': etag,
+            'last_modified': last_modified,
+            'fetched_at': time.time(),
+            'rates_map': rates_map,
+        }, timeout=None)
 
-    soup = BeautifulSoup(html_content, 'html.parser')
-    tables = soup.find_all('table')
+    return rates_map
 
+def stream_duty_rates(response):
+    """
+    Parse duty rates from the lex.uz page while it is still downloading.
+    Each table is read as soon as its closing tag arrives and then cleared.
+    Returns: dict {code: rate}, or None if the page was empty
+    """
+    parser = lxml.etree.HTMLPullParser(events=('end',), tag='table')
     rates_map = {}
+    received = False
 
-    for table in tables:
-        headers = [th.get_text(strip=True) for th in table.find_all(['th', 'td'])]
-        header_text = " ".join(headers)
-
-        if (
-            "ТИФ ТНнинг 2022 йилги таҳрири" in header_text
-            and "Импорт божхона божи ставкаси" in header_text
-        ):
-            rows = table.find_all('tr')
-            for row in rows:
-                cells = row.find_all('td')
-                if not cells:
-                    continue
-
-                cell_texts = [cell.get_text(strip=True) for cell in cells]
-
-                if len(cell_texts) >= 3:
-                    code_str = cell_texts[0]
-                    rate = cell_texts[2]
-                elif len(cell_texts) == 2:
-                    code_str = cell_texts[0]
-                    rate = cell_texts[1]
-                else:
-                    continue
-
-                if "ТИФ ТНнинг" in code_str:
-                    continue
-
-                # Translate rate
-                rate = translate_rate(rate)
-
-                codes = [c.strip().replace(" ", "") for c in code_str.split(',')]
-                for code in codes:
-                    rates_map[code] = rate
+    for chunk in response.iter_content(chunk_size=16384, decode_unicode=True):
+        received = received or bool(chunk)
+        parser.feed(chunk)
+        _read_finished_tables(parser, rates_map)
+
+    if not received:
+        return None
+
+    parser.close()
+    _read_finished_tables(parser, rates_map)
 
     return rates_map
 
-def get_duty_rate(code, rates_map):
+def _read_finished_tables(parser, rates_map):
+    """
+    Read the tables the parser has completed since the last call.
+    """
+    for _, table in parser.read_events():
+        _read_rates_table(table, rates_map)
+
+        # Nested tables are still needed by the enclosing table
+        if next(table.iterancestors('table'), None) is None:
+            table.clear()
+
+def _read_rates_table(table, rates_map):
+    """
+    Add the rates of a table to rates_map if its header marks it
+    as the import duty rates table.
+    """
+    # Only the first row holds the header, so other cells are never read
+    first_row = next(table.iter('tr'), None)
+    if first_row is None:
+        return
+
+    headers = [_element_text(th) for th in first_row.xpath('.//th | .//td')]
+    header_text = " ".join(headers)
+
+    if all(marker in header_text for marker in _RATES_HEADER_MARKERS):
+        rows = table.xpath('.//tr')
+        for row in rows:
+            cells = row.xpath('.//td')
+            if not cells:
+                continue
+
+            cell_texts = [_element_text(cell) for cell in cells]
+
+            if len(cell_texts) >= 3:
+                code_str = cell_texts[0]
+                rate = cell_texts[2]
+            elif len(cell_texts) == 2:
+                code_str = cell_texts[0]
+                rate = cell_texts[1]
+            else:
+                continue
+
+            if "ТИФ ТНнинг" in code_str:
+                continue
+
+            # Translate rate
+            rate = translate_rate(rate)
+
+            codes = [c.strip().replace(" ", "") for c in code_str.split(',')]
+            for code in codes:
+                rates_map[code] = rate
+
+def build_rates_trie(rates_map):
+    """
+    Build a prefix trie from rates_map for longest prefix matching.
+    Each node is a dict keyed by character; the '$' key holds the rate.
+    """
+    trie = {}
+    for prefix, rate in rates_map.items():
+        # Prefixes shorter than 2 characters are never matched
+        if len(prefix) < 2:
+            continue
+        node = trie
+        for ch in prefix:
+            node = node.setdefault(ch, {})
+        node['$'] = rate
+    return trie
+
+def get_duty_rate(code, trie):
     """
     Find duty rate for a code using longest prefix matching.
     """
@@ -337,75 +532,75 @@ def get_duty_rate(code, rates_map):
     # Clean code for matching
     clean_code = code.replace(' ', '')
     
-    # Try to find match from longest to shortest
-    for i in range(len(clean_code), 1, -1):
-        prefix = clean_code[:i]
-        if prefix in rates_map:
-            return rates_map[prefix]
+    # Walk down the trie, remembering the deepest rate seen
+    best = ""
+    node = trie
+    for ch in clean_code:
+        node = node.get(ch)
+        if node is None:
+            break
+        if '$' in node:
+            best = node['$']
             
-    return ""
+    return best
 
 def generate_tn_ved_excel(
         units,
         tn_ved_codes,
-        duty_rates_url
+        rates_map
 ):
-    # Fetch duty rates
-    rates_map = fetch_duty_rates(duty_rates_url)
+    """
+    Build the TN VED Excel file
+    Returns: bytes of the .xlsx file
+    """
+    # rates_map is fetched by the caller so the download can overlap with document parsing
+    rates_trie = build_rates_trie(rates_map)
 
     # Create unit → code map
     unit_code_map = {u['symbol']: u['code'] for u in units}
     unit_code_map[''] = ''  # Handle empty fields
 
-    # Create workbook
-    wb = Workbook()
-    sheet = wb.active
-    sheet.title = "ТН ВЭД"
-
-    # Define styles
-    header_font = Font(bold=True, color="FFFFFF", size=11)
-    header_fill = PatternFill("solid", fgColor="4472C4")
-    header_alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-    thin_border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
-    )
+    buffer = io.BytesIO()
+
+    # Create workbook; constant memory mode flushes each row as soon as the
+    # next one is started. Cell text is written as-is, never as formulas or links.
+    wb = xlsxwriter.Workbook(buffer, {
+        'constant_memory': True,
+        'strings_to_formulas': False,
+        'strings_to_urls': False,
+    })
+    sheet = wb.add_worksheet("ТН ВЭД")
+
+    # Column widths
+    sheet.set_column(0, 0, 20)
+    sheet.set_column(1, 1, 70)
+    sheet.set_column(2, 2, 15)
+    sheet.set_column(3, 3, 12)
+    sheet.set_column(4, 4, 15)
+
+    # Freeze header
+    sheet.freeze_panes(1, 0)
 
     # Set headers
     headers = ["code", "description", "unit", "unit code", "duty_rate_value"]
+    sheet.write_row(0, 0, headers, wb.add_format(_HEADER_FORMAT))
 
-    for col, header in enumerate(headers, 1):
-        cell = sheet.cell(row=1, column=col, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = header_alignment
-        cell.border = thin_border
+    # Fill rows; bound methods are looked up once outside the loop
+    write_row = sheet.write_row
+    get_unit_code = unit_code_map.get
 
-    # Fill rows
-    for row_idx, entry in enumerate(tn_ved_codes, start=2):
+    for row_idx, entry in enumerate(tn_ved_codes, start=1):
         code = entry.get('code', '')
-        name = entry.get('name', '')
         unit = entry.get('unit', '')
-        unit_code = unit_code_map.get(unit, '')
-        
-        duty_rate = get_duty_rate(code, rates_map)
-        
-        sheet.cell(row=row_idx, column=1, value=code)
-        sheet.cell(row=row_idx, column=2, value=name)
-        sheet.cell(row=row_idx, column=3, value=unit)
-        sheet.cell(row=row_idx, column=4, value=unit_code)
-        sheet.cell(row=row_idx, column=5, value=duty_rate)
 
-    # Column widths
-    sheet.column_dimensions['A'].width = 20
-    sheet.column_dimensions['B'].width = 70
-    sheet.column_dimensions['C'].width = 15
-    sheet.column_dimensions['D'].width = 12
-    sheet.column_dimensions['E'].width = 15
+        write_row(row_idx, 0, [
+            code,
+            entry.get('name', ''),
+            unit,
+            get_unit_code(unit, ''),
+            get_duty_rate(code, rates_trie),
+        ])
 
-    # Freeze header
-    sheet.freeze_panes = "A2"
+    wb.close()
 
-    return wb
+    return buffer.getvalue()
@@ -1,6 +1,11 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
 urlpatterns = [
-    path('', views.process_document, name='process_document'),
+    path(
+        '',
+        views.process_document_async if settings.PROCESSOR_ASYNC_VIEWS else views.process_document,
+        name='process_document'
+    ),
 ]
@@ -1,8 +1,9 @@
 from django.shortcuts import render
 from django.http import HttpResponse
 from .forms import UploadForm
-from .services import extract_all, generate_tn_ved_excel
-import io
+from .services import extract_all, fetch_duty_rates, generate_tn_ved_excel
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 
 def process_document(request):
     if request.method == 'POST':
@@ -10,31 +11,70 @@ def process_document(request):
         if form.is_valid():
             docx_file = request.FILES['file']
             url = form.cleaned_data['url']
-            
+
+            try:
+                with ThreadPoolExecutor(max_workers=1) as executor:
+                    # Start fetching duty rates while the file is processed
+                    rates_future = executor.submit(fetch_duty_rates, url)
+
+                    # Process the file
+                    abbreviations, units, tn_ved_codes = extract_all(docx_file)
+
+                    rates_map = rates_future.result()
+
+                # Generate Excel
+                content = generate_tn_ved_excel(units, tn_ved_codes, rates_map)
+
+                return excel_response(content)
+
+            except Exception as e:
+                form.add_error(None, f"Error processing file: {str(e)}")
+    else:
+        form = UploadForm()
+
+    return render(request, 'processor/index.html', {'form': form})
+
+async def process_document_async(request):
+    """
+    Same as process_document, but the blocking work runs in threads so the
+    worker is free to serve other requests while lex.uz is being fetched.
+    """
+    if request.method == 'POST':
+        form = UploadForm(request.POST, request.FILES)
+        if form.is_valid():
+            docx_file = request.FILES['file']
+            url = form.cleaned_data['url']
+
             try:
-                # Process the file
-                abbreviations, units, tn_ved_codes = extract_all(docx_file)
-                
+                # Start fetching duty rates while the file is processed
+                rates_task = asyncio.create_task(asyncio.to_thread(fetch_duty_rates, url))
+
+                try:
+                    # Process the file
+                    abbreviations, units, tn_ved_codes = await asyncio.to_thread(extract_all, docx_file)
+                except Exception:
+                    rates_task.cancel()
+                    raise
+
+                rates_map = await rates_task
+
                 # Generate Excel
-                wb = generate_tn_ved_excel(units, tn_ved_codes, url)
-                
-                # Save to buffer
-                buffer = io.BytesIO()
-                wb.save(buffer)
-                buffer.seek(0)
-                
-                # Create response
-                response = HttpResponse(
-                    buffer.getvalue(),
-                    content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-                )
-                response['Content-Disposition'] = 'attachment; filename="tn_ved_processed.xlsx"'
-                response.set_cookie('fileDownload', 'true', max_age=20)
-                return response
-                
+                content = await asyncio.to_thread(generate_tn_ved_excel, units, tn_ved_codes, rates_map)
+
+                return excel_response(content)
+
             except Exception as e:
                 form.add_error(None, f"Error processing file: {str(e)}")
     else:
         form = UploadForm()
-    
+
     return render(request, 'processor/index.html', {'form': form})
+
+def excel_response(content):
+    response = HttpResponse(
+        content,
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    )
+    response['Content-Disposition'] = 'attachment; filename="tn_ved_processed.xlsx"'
+    response.set_cookie('fileDownload', 'true', max_age=20)
+    return response
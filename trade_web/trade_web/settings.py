@@ -69,6 +69,10 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'trade_web.wsgi.application'
 
+# Serve uploads with the async view so a worker is not blocked while duty
+# rates are fetched (run under ASGI). Set to False to use the sync view.
+PROCESSOR_ASYNC_VIEWS = True
+
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
@@ -81,6 +85,17 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 